@@ -33,6 +33,12 @@ const studentSchema = new mongoose.Schema({
   currentHash: String
 }, { collection: 'students' });
 
+// Shared id counters (same documents uchain.py reserves eid blocks from)
+const counterSchema = new mongoose.Schema({
+  _id: String,
+  seq: Number
+}, { collection: 'counters' });
+
 const classSchema = new mongoose.Schema({
   cid: Number,
   name: String,
@@ -47,6 +53,38 @@ if (mongoose.models.Enrollment) {
 const Enrollment = mongoose.model('Enrollment', enrollmentSchema);
 const Student = mongoose.models.Student || mongoose.model('Student', studentSchema);
 const Class = mongoose.models.Class || mongoose.model('Class', classSchema);
+const Counter = mongoose.models.Counter || mongoose.model('Counter', counterSchema);
+
+let eidCounterSeeded = null;
+
+/**
+ * Atomically allocate the next enrollment id from the counters collection.
+ * The counter is seeded once from the highest existing eid so ids handed out
+ * here never collide with data loaded before the counter existed.
+ */
+async function nextEid() {
+  if (!eidCounterSeeded) {
+    eidCounterSeeded = (async () => {
+      const lastEnrollment = await Enrollment.findOne().sort({ eid: -1 }).select('eid');
+      await Counter.updateOne(
+        { _id: 'eid' },
+        { $max: { seq: lastEnrollment ? lastEnrollment.eid : 0 } },
+        { upsert: true }
+      );
+    })().catch(err => {
+      eidCounterSeeded = null;
+      throw err;
+    });
+  }
+  await eidCounterSeeded;
+
+  const counter = await Counter.findOneAndUpdate(
+    { _id: 'eid' },
+    { $inc: { seq: 1 } },
+    { new: true, upsert: true }
+  );
+  return counter.seq;
+}
 
 // Web3 and Contract Setup
 const web3 = new Web3(new Web3.providers.HttpProvider(process.env.GANACHE_RPC || 'http://127.0.0.1:8545'));
@@ -110,8 +148,7 @@ router.post('/', async (req, res) => {
     }
 
     // Get next EID
-    const lastEnrollment = await Enrollment.findOne().sort({ eid: -1 });
-    const eid = lastEnrollment ? lastEnrollment.eid + 1 : 1;
+    const eid = await nextEid();
 
     // Step 1: Store on blockchain and get hash
     const receipt = await contract.methods.storeEnrollment(
@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Reports are split into ranges of a numeric id and each range is aggregated
+# on its own thread. The MongoClient is thread-safe and hands every worker its
+# own pooled connection, so the partial aggregations really run side by side
+# on the server. Partial counts are then summed here.
+#
+# Reports only read. The partition fields are indexed when the database is
+# set up (uchain.create_database_and_collections); without those indexes
+# every range $match is a full collection scan.
+DEFAULT_PARALLELISM = os.cpu_count() or 4
+GRADE_BATCH = 2000
+
+PROFESSOR_BUCKETS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 20, 50]
+
+
+def partition_ranges(collection, field, parts):
+    if parts <= 1:
+        return [(None, None)]
+    first = collection.find_one({field: {"$type": "number"}}, sort=[(field, 1)], projection={field: 1})
+    last = collection.find_one({field: {"$type": "number"}}, sort=[(field, -1)], projection={field: 1})
+    if not first:
+        return [(None, None)]
+    lo, hi = int(first[field]), int(last[field]) + 1
+    step = max(1, -(-(hi - lo) // parts))
+    bounds = list(range(lo, hi, step))[1:]
+    # Open-ended first and last ranges so documents outside [lo, hi) (or
+    # without the field at all) are still counted exactly once.
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def range_match(field, lo, hi):
+    if lo is None and hi is None:
+        return []
+    if lo is None:
+        return [{"$match": {field: {"$not": {"$gte": hi}}}}]
+    if hi is None:
+        return [{"$match": {field: {"$gte": lo}}}]
+    return [{"$match": {field: {"$gte": lo, "$lt": hi}}}]
+
+
+def run_partitioned(collection, field, work, parallelism=DEFAULT_PARALLELISM):
+    ranges = partition_ranges(collection, field, parallelism)
+    if len(ranges) == 1:
+        return [work(range_match(field, *ranges[0]))]
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        return list(pool.map(lambda r: work(range_match(field, *r)), ranges))
+
+
+def merge_counts(partials):
+    merged = {}
+    for partial in partials:
+        for key, count in partial.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+# -------------------------------------------------------------------------
+def students_per_university(db, parallelism=DEFAULT_PARALLELISM):
+    def work(match):
+        pipeline = match + [
+            {"$lookup": {
+                "from": "departments",
+                "localField": "did",
+                "foreignField": "did",
+                "as": "department"
+            }},
+            {"$unwind": "$department"},
+            {"$lookup": {
+                "from": "schools",
+                "localField": "did",
+                "foreignField": "departments",
+                "as": "school"
+            }},
+            {"$unwind": "$school"},
+            {"$lookup": {
+                "from": "universities",
+                "localField": "school.sid",
+                "foreignField": "schools",
+                "as": "university"
+            }},
+            {"$unwind": "$university"},
+            {"$group": {
+                "_id": "$university.name",
+                "student_count": {"$sum": 1}
+            }}
+        ]
+        return {r["_id"]: r["student_count"] for r in db.students.aggregate(pipeline)}
+
+    counts = merge_counts(run_partitioned(db.students, "stid", work, parallelism))
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)
+
+
+def students_sharing_professors(db, parallelism=DEFAULT_PARALLELISM):
+    # Partitioned on sid so each student's enrollments land in one range and
+    # the per-student professor sets are complete before bucketing.
+    def work(match):
+        pipeline = match + [
+            {"$lookup": {
+                "from": "classes",
+                "localField": "cid",
+                "foreignField": "cid",
+                "as": "class"
+            }},
+            {"$unwind": "$class"},
+            {"$group": {
+                "_id": "$sid",
+                "professors": {"$addToSet": "$class.pid"}
+            }},
+            {"$bucket": {
+                "groupBy": {"$size": "$professors"},
+                "boundaries": PROFESSOR_BUCKETS,
+                "default": "50+",
+                "output": {
+                    "students": {"$sum": 1}
+                }
+            }}
+        ]
+        return {r["_id"]: r["students"] for r in db.enrollments.aggregate(pipeline, maxTimeMS=6000000)}
+
+    counts = merge_counts(run_partitioned(db.enrollments, "sid", work, parallelism))
+    return sorted(counts.items(), key=lambda item: (isinstance(item[0], str), item[0]))
+
+
+def _count_grades(decrypt, rows):
+    counts = {}
+    for token, key in rows:
+        try:
+            grade = decrypt(token, key.encode())
+            counts[grade] = counts.get(grade, 0) + 1
+        except:
+            pass
+    return counts
+
+
+def grade_distribution(db, decrypt, parallelism=DEFAULT_PARALLELISM):
+    # Fernet decryption is Python code holding the GIL, so threads alone would
+    # not scale it. The partition threads only fetch; batches of tokens are
+    # decrypted in a process pool. decrypt must be a picklable module-level
+    # function.
+    #
+    # The decryptors are spawned rather than forked: forking while the
+    # MongoClient's monitor and pool threads are running can deadlock the
+    # child. Fetch threads mostly wait on the server, so they get a quarter
+    # of the budget and the decryptors the rest.
+    pipeline_tail = [{"$project": {"_id": 0, "grade": 1, "grade_key": 1}}]
+    if parallelism <= 1:
+        rows = ((e.get("grade"), e.get("grade_key")) for e in db.enrollments.aggregate(pipeline_tail))
+        return _count_grades(decrypt, rows)
+
+    fetchers = max(1, parallelism // 4)
+    with ProcessPoolExecutor(max_workers=max(1, parallelism - fetchers),
+                             mp_context=multiprocessing.get_context("spawn")) as decryptors:
+        def work(match):
+            futures = []
+            rows = []
+            for e in db.enrollments.aggregate(match + pipeline_tail):
+                rows.append((e.get("grade"), e.get("grade_key")))
+                if len(rows) >= GRADE_BATCH:
+                    futures.append(decryptors.submit(_count_grades, decrypt, rows))
+                    rows = []
+            if rows:
+                futures.append(decryptors.submit(_count_grades, decrypt, rows))
+            return merge_counts(f.result() for f in futures)
+
+        return merge_counts(run_partitioned(db.enrollments, "eid", work, fetchers))
@@ -0,0 +1,323 @@
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from pymongo import MongoClient, errors
+
+# Shard keys are picked for how the collections are read, not for their ids.
+# eid/stid/cid only ever grow, so range-sharding on them sends every insert
+# to the last chunk.
+#
+# enrollments: transcript reads are find({"sid": ...}), so a hashed sid keeps
+#   each student on one shard while spreading inserts evenly.
+# students: dids are handed out contiguously per university, so {did, stid}
+#   keeps a university's students in one range for uid rollups; stid makes
+#   the key fine-grained enough to split. Chunks are pre-split at university
+#   boundaries.
+# students_enrollments: the vertical fragment is read by stid only.
+#
+# Reference collections (universities ... classes) are small and stay
+# unsharded on the primary shard.
+SHARD_PLAN = {
+    "enrollments": {
+        "key": {"sid": "hashed"},
+        "targets": ["sid"],
+        "chunks_per_shard": 4,
+    },
+    "students": {
+        "key": {"did": 1, "stid": 1},
+        "targets": ["did", "stid"],
+        "presplit": "university",
+    },
+    "students_enrollments": {
+        "key": {"stid": "hashed"},
+        "targets": ["stid"],
+        "chunks_per_shard": 2,
+    },
+}
+KNOWN_COLLECTIONS = {
+    "universities", "schools", "departments", "advisors", "students",
+    "professors", "classes", "enrollments", "students_enrollments",
+}
+MONOTONIC_FIELDS = {"eid", "stid", "cid", "pid", "aid"}
+LOW_CARDINALITY_FIELDS = {"uid", "did"}
+
+
+def validate_shard_plan(plan=SHARD_PLAN):
+    problems = []
+    for collection, config in plan.items():
+        key = config.get("key") or {}
+        fields = list(key)
+        if collection not in KNOWN_COLLECTIONS:
+            problems.append(f"{collection}: unknown collection")
+        if not fields:
+            problems.append(f"{collection}: empty shard key")
+            continue
+        hashed = [f for f, kind in key.items() if kind == "hashed"]
+        if len(hashed) > 1:
+            problems.append(f"{collection}: at most one hashed field is allowed, got {hashed}")
+        if key[fields[0]] != "hashed" and fields[0] in MONOTONIC_FIELDS:
+            problems.append(f"{collection}: range key on monotonically increasing '{fields[0]}' sends all inserts to one chunk")
+        if len(fields) == 1 and key[fields[0]] != "hashed" and fields[0] in LOW_CARDINALITY_FIELDS:
+            problems.append(f"{collection}: '{fields[0]}' alone is too coarse and will produce jumbo chunks")
+        if fields[0] not in config.get("targets", []):
+            problems.append(f"{collection}: shard key prefix '{fields[0]}' is not one of the query targets {config.get('targets', [])}")
+        if config.get("presplit") and hashed:
+            problems.append(f"{collection}: hashed keys are pre-split with chunks_per_shard, not presplit")
+        if config.get("chunks_per_shard") and not hashed:
+            problems.append(f"{collection}: chunks_per_shard only applies to hashed keys")
+    return problems
+
+
+def list_shards(client):
+    return [s["_id"] for s in client.admin.command("listShards")["shards"]]
+
+
+def is_sharded(client, ns):
+    # Pre-5.0 servers keep dropped collections around with dropped: true.
+    meta = client.config.collections.find_one({"_id": ns})
+    return bool(meta) and not meta.get("dropped")
+
+
+def university_split_points(db):
+    # First did of every university after the first, in did order.
+    school_dids = {s["sid"]: s.get("departments", []) for s in db.schools.find()}
+    firsts = []
+    for university in db.universities.find():
+        dids = [did for sid in university.get("schools", []) for did in school_dids.get(sid, [])]
+        if dids:
+            firsts.append(min(dids))
+    return [{"did": did, "stid": MinKey()} for did in sorted(firsts)[1:]]
+
+
+def _presplit_range(client, ns, key, points, shards, primary):
+    bounds = [{f: MinKey() for f in key}] + points + [{f: MaxKey() for f in key}]
+    for point in points:
+        client.admin.command("split", ns, middle=point)
+    # Round-robin the new chunks so each shard owns some ranges up front
+    # instead of waiting for the balancer.
+    for i, (lower, upper) in enumerate(zip(bounds, bounds[1:])):
+        target = shards[i % len(shards)]
+        if target != primary:
+            client.admin.command("moveChunk", ns, bounds=[lower, upper], to=target)
+
+
+def apply_shard_plan(client, db_name, plan=SHARD_PLAN):
+    problems = validate_shard_plan(plan)
+    if problems:
+        raise ValueError("Invalid shard plan:\n  " + "\n  ".join(problems))
+
+    db = client[db_name]
+    shards = list_shards(client)
+    try:
+        client.admin.command("enableSharding", db_name)
+        print("Sharding enabled on database.")
+    except errors.OperationFailure as err:
+        print(f"Failed to enable sharding: {err}")
+    primary = (client.config.databases.find_one({"_id": db_name}) or {}).get("primary")
+
+    for collection, config in plan.items():
+        ns = f"{db_name}.{collection}"
+        key = config["key"]
+        # Re-running the plan must not split or move chunks a second time.
+        if is_sharded(client, ns):
+            print(f"{collection} is already sharded, skipping.")
+            continue
+        options = {"key": key}
+        if config.get("chunks_per_shard") and db[collection].estimated_document_count() == 0:
+            options["numInitialChunks"] = config["chunks_per_shard"] * len(shards)
+        try:
+            db[collection].create_index(list(key.items()))
+            client.admin.command("shardCollection", ns, **options)
+            print(f"Sharded {collection} with key {key}")
+        except errors.OperationFailure as err:
+            print(f"Failed to shard {collection}: {err}")
+            continue
+        if config.get("presplit") == "university" and len(shards) > 1:
+            _presplit_range(client, ns, key, university_split_points(db), shards, primary)
+
+
+def chunk_distribution(client, db_name, collection):
+    ns = f"{db_name}.{collection}"
+    meta = client.config.collections.find_one({"_id": ns})
+    if not meta:
+        return {}
+    # config.chunks is keyed by ns before 5.0 and by collection uuid after.
+    query = {"uuid": meta["uuid"]} if "uuid" in meta else {"ns": ns}
+    counts = {}
+    for chunk in client.config.chunks.find(query, {"shard": 1}):
+        counts[chunk["shard"]] = counts.get(chunk["shard"], 0) + 1
+    return counts
+
+
+def document_distribution(client, db_name, collection):
+    # $collStats through mongos returns one document per shard holding data.
+    stats = client[db_name][collection].aggregate([{"$collStats": {"count": {}}}])
+    return {s.get("shard", "primary"): s["count"] for s in stats}
+
+
+# -------------------------------------------------------------------------
+# Local mongod/mongos cluster for tests and benchmarks. Needs the MongoDB
+# server binaries on PATH; no containers involved.
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalCluster:
+    def __init__(self, shards=2, base_dir=None, mongod="mongod", mongos="mongos", timeout=60):
+        self.shards = shards
+        self.base_dir = base_dir
+        self.mongod = shutil.which(mongod) or mongod
+        self.mongos = shutil.which(mongos) or mongos
+        self.timeout = timeout
+        self.processes = []
+        self.port = None
+        self._tmp = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def uri(self):
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def client(self, **options):
+        return MongoClient(self.uri, **options)
+
+    def _spawn(self, args, name):
+        log = os.path.join(self.base_dir, f"{name}.log")
+        self.processes.append(subprocess.Popen(
+            args + ["--bind_ip", "127.0.0.1", "--logpath", log],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    def _start_replset(self, name, role):
+        port = _free_port()
+        dbpath = os.path.join(self.base_dir, name)
+        os.makedirs(dbpath, exist_ok=True)
+        self._spawn([self.mongod, role, "--replSet", name, "--port", str(port),
+                     "--dbpath", dbpath, "--wiredTigerCacheSizeGB", "0.25"], name)
+        client = self._wait(port, directConnection=True)
+        config = {"_id": name, "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]}
+        if role == "--configsvr":
+            config["configsvr"] = True
+        client.admin.command("replSetInitiate", config)
+        deadline = time.monotonic() + self.timeout
+        while not client.admin.command("hello").get("isWritablePrimary"):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{name} never became primary")
+            time.sleep(0.2)
+        client.close()
+        return f"{name}/127.0.0.1:{port}"
+
+    def _wait(self, port, **options):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            client = MongoClient(f"mongodb://127.0.0.1:{port}", serverSelectionTimeoutMS=500, **options)
+            try:
+                client.admin.command("ping")
+                return client
+            except errors.PyMongoError:
+                client.close()
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Nothing listening on port {port}")
+                time.sleep(0.2)
+
+    def start(self):
+        if self.base_dir is None:
+            self._tmp = tempfile.mkdtemp(prefix="uchain-cluster-")
+            self.base_dir = self._tmp
+        try:
+            configdb = self._start_replset("cfg", "--configsvr")
+            shard_hosts = [self._start_replset(f"shard{i}", "--shardsvr") for i in range(self.shards)]
+            self.port = _free_port()
+            self._spawn([self.mongos, "--configdb", configdb, "--port", str(self.port)], "mongos")
+            client = self._wait(self.port)
+            for host in shard_hosts:
+                client.admin.command("addShard", host)
+            client.close()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        if self._tmp:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
+            self.base_dir = None
+
+
+def synthetic_reference_data(universities=4, schools_per_university=2, departments_per_school=2):
+    # Same shape as the data generator: dids are contiguous per university.
+    unis, schools, departments = [], [], []
+    for uid in range(1, universities + 1):
+        uni_schools = []
+        for _ in range(schools_per_university):
+            sid = len(schools) + 1
+            dids = list(range(len(departments) + 1, len(departments) + departments_per_school + 1))
+            departments.extend({"did": did, "name": f"Dept {did}"} for did in dids)
+            schools.append({"sid": sid, "name": f"School {sid}", "departments": dids})
+            uni_schools.append(sid)
+        unis.append({"uid": uid, "name": f"University {uid}", "schools": uni_schools})
+    return {"universities": unis, "schools": schools, "departments": departments}
+
+
+def measure_cluster(client, db_name, students=20000, enrollments=100000, workers=8, batch_size=1000, reads=2000, seed=0):
+    rng = random.Random(seed)
+    db = client[db_name]
+    for collection, docs in synthetic_reference_data().items():
+        db[collection].insert_many(docs)
+    dids = [d["did"] for d in db.departments.find()]
+    apply_shard_plan(client, db_name)
+
+    student_docs = [{"stid": stid, "did": rng.choice(dids), "firstName": "S", "lastName": str(stid)}
+                    for stid in range(1, students + 1)]
+    enrollment_docs = [{"eid": eid, "sid": rng.randint(1, students), "cid": rng.randint(1, 200),
+                        "grade": rng.choice("ABCDF"), "status": "Completed"}
+                       for eid in range(1, enrollments + 1)]
+
+    def insert(collection, docs):
+        batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda b: db[collection].insert_many(b, ordered=False), batches))
+        return time.perf_counter() - started
+
+    timings = {
+        "insert_students": insert("students", student_docs),
+        "insert_enrollments": insert("enrollments", enrollment_docs),
+    }
+
+    sids = [rng.randint(1, students) for _ in range(reads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda sid: list(db.enrollments.find({"sid": sid})), sids))
+    timings["transcript_reads"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    list(db.students.aggregate([{"$group": {"_id": "$did", "students": {"$sum": 1}}}]))
+    timings["did_rollup"] = time.perf_counter() - started
+
+    timings["enrollments_per_sec"] = enrollments / timings["insert_enrollments"]
+    timings["reads_per_sec"] = reads / timings["transcript_reads"]
+    return timings
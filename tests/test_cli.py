@@ -0,0 +1,68 @@
+import pytest
+import os
+import subprocess
+import sys
+import types
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import uchain
+from uchain import REPORTS, build_parser, main, setup_sharding
+
+HEAVY_MODULES = ['pymongo', 'cryptography', 'web3', 'sharding', 'tx_pipeline', 'reports', 'concurrent.futures.process']
+
+def test_import_is_lazy():
+    code = (
+        "import sys, uchain\n"
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "assert not loaded, loaded\n"
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, check=True)
+
+def test_help_needs_no_server():
+    result = subprocess.run([sys.executable, 'uchain.py', '--help'], cwd=BASE_DIR, capture_output=True, text=True)
+    assert result.returncode == 0
+    for command in ('load', 'shard', 'fragment', 'report', 'get', 'bench'):
+        assert command in result.stdout
+
+def test_parse_get():
+    args = build_parser().parse_args(['--timing', 'get', '42'])
+    assert args.command == 'get'
+    assert args.eid == 42
+    assert args.timing
+
+@pytest.mark.parametrize("name", list(REPORTS) + ['all'])
+def test_parse_report(name):
+    args = build_parser().parse_args(['report', name, '-p', '4'])
+    assert args.name == name
+    assert args.parallelism == 4
+
+def test_parse_bench():
+    args = build_parser().parse_args(['bench', 'shards', '--shards', '1', '2'])
+    assert args.target == 'shards'
+    assert args.shards == [1, 2]
+
+def test_parse_bench_tx_is_bounded():
+    args = build_parser().parse_args(['bench', 'tx'])
+    assert args.count > 0
+    assert args.scratch_db != args.db
+
+def test_unknown_report_rejected():
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(['report', 'nope'])
+
+def test_missing_uri_fails_cleanly(monkeypatch, capsys):
+    monkeypatch.setattr(uchain, 'mongo_uri', lambda: '')
+    assert main(['get', '1']) == 2
+    assert 'MONGO_URI' in capsys.readouterr().out
+
+def test_shard_uses_selected_db(monkeypatch):
+    calls = []
+    fake = types.SimpleNamespace(apply_shard_plan=lambda client, db_name: calls.append(db_name))
+    monkeypatch.setitem(sys.modules, 'sharding', fake)
+    setup_sharding(types.SimpleNamespace(client=object(), name='foo'))
+    assert calls == ['foo']
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
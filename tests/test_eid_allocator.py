@@ -0,0 +1,108 @@
+import pytest
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+if not MONGO_URI:
+    raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file.")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from pymongo.errors import DuplicateKeyError
+from uchain import COUNTERS_COLLECTION, EidAllocator, create_database_and_collections, load_and_insert_data, next_eid, reserve_eids, seed_eid_counter
+
+TEST_DB = 'uchain_test_counters'
+
+@pytest.fixture(scope="module")
+def mongo_client():
+    client = MongoClient(MONGO_URI)
+    yield client
+    client.drop_database(TEST_DB)
+    client.close()
+
+@pytest.fixture(scope="function")
+def db(mongo_client):
+    db = mongo_client[TEST_DB]
+    db[COUNTERS_COLLECTION].delete_many({})
+    db.enrollments.delete_many({})
+    return db
+
+def test_seed_from_existing_enrollments(db):
+    db.enrollments.insert_many([{'eid': 7}, {'eid': 42}, {'eid': 3}])
+    seed_eid_counter(db)
+    assert next_eid(db) == 43
+
+def test_first_allocation_seeds_from_existing_enrollments(db):
+    # No counters document yet, as on a database loaded before it existed.
+    db.enrollments.insert_many([{'eid': 7}, {'eid': 42}])
+    assert next_eid(db) == 43
+    assert EidAllocator(db, block_size=10).next() == 44
+
+def test_seed_never_moves_counter_back(db):
+    seed_eid_counter(db, 100)
+    seed_eid_counter(db, 10)
+    assert next_eid(db) == 101
+
+def test_reserve_block_is_contiguous(db):
+    first = reserve_eids(db, 500)
+    second = reserve_eids(db, 1)
+    assert list(first) == list(range(1, 501))
+    assert list(second) == [501]
+
+def test_reserve_rejects_empty_block(db):
+    with pytest.raises(ValueError):
+        reserve_eids(db, 0)
+
+def test_allocator_uses_one_round_trip_per_block(db):
+    allocator = EidAllocator(db, block_size=10)
+    ids = [allocator.next() for _ in range(25)]
+    assert ids == list(range(1, 26))
+    assert db[COUNTERS_COLLECTION].find_one({'_id': 'eid'})['seq'] == 30
+
+def test_concurrent_allocators_never_collide(db):
+    def allocate(_):
+        allocator = EidAllocator(db, block_size=50)
+        return [allocator.next() for _ in range(200)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        batches = list(pool.map(allocate, range(8)))
+    ids = [eid for batch in batches for eid in batch]
+    assert len(ids) == len(set(ids)), "Duplicate eids handed out"
+
+def test_duplicate_eid_rejected_by_index(db):
+    create_database_and_collections(db.client, TEST_DB)
+    db.enrollments.insert_one({'eid': 1})
+    with pytest.raises(DuplicateKeyError):
+        db.enrollments.insert_one({'eid': 1})
+
+def test_loader_keeps_file_eids(db, tmp_path):
+    # students.enrollments refers to the file ids, so they must survive;
+    # only rows without one are allocated, past the highest file id.
+    rows = [{'eid': 9, 'sid': 1, 'cid': 1, 'grade': 'A', 'status': 'Completed'},
+            {'eid': 5, 'sid': 2, 'cid': 1, 'grade': 'B', 'status': 'Completed'},
+            {'sid': 3, 'cid': 2, 'grade': 'NG', 'status': 'Enrolled'}]
+    with open(tmp_path / 'Enrollments.json', 'w') as f:
+        json.dump(rows, f)
+    load_and_insert_data(db, str(tmp_path))
+    eids = {e['sid']: e['eid'] for e in db.enrollments.find()}
+    assert eids == {1: 9, 2: 5, 3: 10}
+    assert next_eid(db) > 10
+
+def test_loader_rejects_duplicate_file_eids(db, tmp_path):
+    rows = [{'eid': 5, 'sid': 1, 'cid': 1, 'grade': 'A', 'status': 'Completed'},
+            {'eid': 5, 'sid': 2, 'cid': 1, 'grade': 'B', 'status': 'Completed'}]
+    with open(tmp_path / 'Enrollments.json', 'w') as f:
+        json.dump(rows, f)
+    with pytest.raises(ValueError, match='Duplicate eids'):
+        load_and_insert_data(db, str(tmp_path))
+    assert db.enrollments.count_documents({}) == 0
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
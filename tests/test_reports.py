@@ -0,0 +1,71 @@
+import pytest
+import os
+import random
+import sys
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+if not MONGO_URI:
+    raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file.")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from reports import grade_distribution, partition_ranges, students_per_university, students_sharing_professors
+from uchain import create_database_and_collections, decrypt_grade, toBlock
+
+TEST_DB = 'uchain_test_reports'
+
+@pytest.fixture(scope="module")
+def db():
+    rng = random.Random(7)
+    client = MongoClient(MONGO_URI)
+    client.drop_database(TEST_DB)
+    db = create_database_and_collections(client, TEST_DB)
+    db.universities.insert_many([{'uid': 1, 'name': 'ASU', 'schools': [1]}, {'uid': 2, 'name': 'SU', 'schools': [2]}])
+    db.schools.insert_many([{'sid': 1, 'departments': [1, 2]}, {'sid': 2, 'departments': [3]}])
+    db.departments.insert_many([{'did': d} for d in (1, 2, 3)])
+    db.classes.insert_many([{'cid': c, 'pid': c % 7 + 1} for c in range(1, 41)])
+    db.students.insert_many([{'stid': s, 'did': rng.randint(1, 3)} for s in range(1, 501)])
+    db.enrollments.insert_many([
+        toBlock({'eid': e, 'sid': rng.randint(1, 500), 'cid': rng.randint(1, 40), 'grade': rng.choice('ABCDF'), 'status': 'Completed'})
+        for e in range(1, 2001)
+    ])
+    yield db
+    client.drop_database(TEST_DB)
+    client.close()
+
+def test_partitions_cover_range_once(db):
+    ranges = partition_ranges(db.students, 'stid', 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    for (_, hi), (lo, _) in zip(ranges, ranges[1:]):
+        assert hi == lo
+
+def test_reports_do_not_create_indexes(db):
+    before = db.classes.index_information()
+    partition_ranges(db.classes, 'cid', 4)
+    assert db.classes.index_information() == before
+
+def test_single_partition_when_serial(db):
+    assert partition_ranges(db.students, 'stid', 1) == [(None, None)]
+
+@pytest.mark.parametrize("parallelism", [2, 4, 16])
+def test_students_per_university_matches_serial(db, parallelism):
+    assert dict(students_per_university(db, parallelism)) == dict(students_per_university(db, 1))
+
+@pytest.mark.parametrize("parallelism", [2, 4, 16])
+def test_students_sharing_professors_matches_serial(db, parallelism):
+    assert students_sharing_professors(db, parallelism) == students_sharing_professors(db, 1)
+
+@pytest.mark.parametrize("parallelism", [2, 4, 16])
+def test_grade_distribution_matches_serial(db, parallelism):
+    counts = grade_distribution(db, decrypt_grade, parallelism)
+    assert counts == grade_distribution(db, decrypt_grade, 1)
+    assert sum(counts.values()) == 2000
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
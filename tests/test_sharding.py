@@ -0,0 +1,97 @@
+import pytest
+import os
+import shutil
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from sharding import SHARD_PLAN, LocalCluster, apply_shard_plan, chunk_distribution, document_distribution, measure_cluster, validate_shard_plan
+
+TEST_DB = 'uchain_test_sharding'
+SHARD_COUNTS = [1, 2, 4]
+STUDENTS = 5000
+ENROLLMENTS = 20000
+
+def test_default_plan_is_valid():
+    assert validate_shard_plan() == []
+
+def test_monotonic_range_key_rejected():
+    problems = validate_shard_plan({'enrollments': {'key': {'eid': 1}, 'targets': ['eid']}})
+    assert any('monotonically' in p for p in problems)
+
+def test_low_cardinality_key_rejected():
+    problems = validate_shard_plan({'students': {'key': {'did': 1}, 'targets': ['did']}})
+    assert any('jumbo' in p for p in problems)
+
+def test_key_must_match_query_targets():
+    problems = validate_shard_plan({'enrollments': {'key': {'cid': 'hashed'}, 'targets': ['sid']}})
+    assert any('query targets' in p for p in problems)
+
+def test_unknown_collection_rejected():
+    problems = validate_shard_plan({'grades': {'key': {'gid': 'hashed'}, 'targets': ['gid']}})
+    assert any('unknown collection' in p for p in problems)
+
+@pytest.fixture(scope="module")
+def scaling(tmp_path_factory):
+    # One cluster per shard count; everything the tests check is collected
+    # while the cluster is up so the counts can be compared afterwards.
+    if not (shutil.which('mongod') and shutil.which('mongos')):
+        pytest.skip("mongod/mongos not on PATH; skipping local cluster tests")
+    results = {}
+    for shards in SHARD_COUNTS:
+        base_dir = str(tmp_path_factory.mktemp(f'cluster{shards}'))
+        with LocalCluster(shards=shards, base_dir=base_dir) as cluster:
+            client = cluster.client()
+            timings = measure_cluster(client, TEST_DB, students=STUDENTS, enrollments=ENROLLMENTS)
+            explain = client[TEST_DB].enrollments.find({'sid': 42}).explain()
+            chunks = {c: chunk_distribution(client, TEST_DB, c) for c in SHARD_PLAN}
+            apply_shard_plan(client, TEST_DB)
+            results[shards] = {
+                'timings': timings,
+                'chunks': chunks,
+                'rerun_chunks': {c: chunk_distribution(client, TEST_DB, c) for c in SHARD_PLAN},
+                'documents': {c: document_distribution(client, TEST_DB, c) for c in ('students', 'enrollments')},
+                'read_shards': len(explain['queryPlanner']['winningPlan'].get('shards', [])),
+            }
+            client.close()
+        t = timings
+        print(f"{shards} shard(s): {t['enrollments_per_sec']:,.0f} inserts/s, "
+              f"{t['reads_per_sec']:,.0f} transcript reads/s, rollup {t['did_rollup']:.3f}s")
+    return results
+
+@pytest.mark.parametrize("shards", SHARD_COUNTS)
+def test_chunks_spread_over_every_shard(scaling, shards):
+    for collection, chunks in scaling[shards]['chunks'].items():
+        assert len(chunks) == shards, f"{collection} chunks not spread: {chunks}"
+        assert max(chunks.values()) <= 2 * min(chunks.values()), f"{collection} chunks unbalanced: {chunks}"
+
+@pytest.mark.parametrize("shards", SHARD_COUNTS)
+def test_rerunning_plan_is_a_no_op(scaling, shards):
+    # The balancer may move chunks in between, but nothing is split again.
+    for collection, chunks in scaling[shards]['chunks'].items():
+        assert sum(scaling[shards]['rerun_chunks'][collection].values()) == sum(chunks.values())
+
+@pytest.mark.parametrize("shards", SHARD_COUNTS)
+def test_documents_balanced_after_load(scaling, shards):
+    documents = scaling[shards]['documents']
+    assert sum(documents['enrollments'].values()) == ENROLLMENTS
+    assert sum(documents['students'].values()) == STUDENTS
+    assert len(documents['students']) == shards, f"students not spread: {documents['students']}"
+    # Hashed sid: every shard should hold close to its even share.
+    fair = ENROLLMENTS / shards
+    for shard, count in documents['enrollments'].items():
+        assert 0.7 * fair <= count <= 1.3 * fair, f"{shard} holds {count} of {ENROLLMENTS} enrollments"
+
+@pytest.mark.parametrize("shards", SHARD_COUNTS)
+def test_transcript_reads_are_targeted(scaling, shards):
+    assert scaling[shards]['read_shards'] <= 1, "Transcript read was broadcast to every shard"
+
+def test_per_shard_load_shrinks_with_more_shards(scaling):
+    # Adding shards has to split the insert load, not funnel it to one chunk.
+    busiest = [max(scaling[k]['documents']['enrollments'].values()) for k in SHARD_COUNTS]
+    assert busiest == sorted(busiest, reverse=True) and busiest[0] > busiest[-1]
+    assert busiest[-1] <= 1.3 * ENROLLMENTS / SHARD_COUNTS[-1]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,114 @@
+import pytest
+import os
+import sys
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+if not MONGO_URI:
+    raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file.")
+
+GANACHE_PRIVATE_KEY = os.getenv('GANACHE_PRIVATE_KEY')
+if not GANACHE_PRIVATE_KEY:
+    pytest.skip("GANACHE_PRIVATE_KEY not set; skipping transaction pipeline tests", allow_module_level=True)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from tx_pipeline import pending_enrollments, submit_enrollments
+
+TEST_DB = 'uchain_test_pipeline'
+ENROLLMENT_COUNT = 50
+
+@pytest.fixture(scope="module")
+def db():
+    client = MongoClient(MONGO_URI)
+    db = client[TEST_DB]
+    db.enrollments.delete_many({})
+    db.students.delete_many({})
+    db.students.insert_many([{'stid': sid, 'enrollments': [], 'currentHash': ''} for sid in range(1, 6)])
+    db.enrollments.insert_many([
+        {'eid': eid, 'sid': eid % 5 + 1, 'cid': 100 + eid, 'grade': 'A', 'status': 'Completed'}
+        for eid in range(1, ENROLLMENT_COUNT + 1)
+    ])
+    yield db
+    client.drop_database(TEST_DB)
+    client.close()
+
+@pytest.fixture(scope="module")
+def stats(db):
+    return submit_enrollments(db, pending_enrollments(db), write_batch=20, max_in_flight=16)
+
+def test_all_transactions_confirmed(stats):
+    assert stats['submitted'] == ENROLLMENT_COUNT
+    assert stats['confirmed'] == ENROLLMENT_COUNT
+    assert stats['failed'] == 0
+    print(f"Throughput: {stats['tps']:.1f} tx/s")
+
+def test_hashes_written_back(db, stats):
+    assert db.enrollments.count_documents({'enrollmentHash': None}) == 0
+    hashes = db.enrollments.distinct('enrollmentHash')
+    assert all(h.startswith('0x') and len(h) == 66 for h in hashes)
+
+def test_student_hashes_updated(db, stats):
+    # Receipts come back out of order; students must still list hashes in eid
+    # order with currentHash on the latest enrollment.
+    for student in db.students.find():
+        own = [e['enrollmentHash'] for e in db.enrollments.find({'sid': student['stid']}).sort('eid', 1)]
+        assert student['enrollments'] == own
+        assert student['currentHash'] == own[-1]
+
+def test_bad_row_does_not_block_later_nonces(db):
+    from tx_pipeline import HashWriter, EnrollmentPipeline
+    import asyncio
+    rows = [
+        {'eid': 1001, 'sid': 1, 'cid': 1, 'grade': 'not-a-token', 'grade_key': 'bad', 'status': 'Completed'},
+        {'eid': 1002, 'sid': 1, 'cid': 2, 'grade': 'B', 'status': 'Completed'},
+    ]
+    db.enrollments.insert_many([dict(r) for r in rows])
+
+    async def run():
+        pipeline = await EnrollmentPipeline.connect(GANACHE_PRIVATE_KEY, receipt_timeout=10)
+        return await pipeline.run(rows, HashWriter(db))
+
+    stats = asyncio.run(run())
+    assert stats['failed'] == 1
+    assert stats['confirmed'] == 1
+    assert db.enrollments.find_one({'eid': 1002})['enrollmentHash']
+    assert db.students.find_one({'stid': 1})['currentHash'] == db.enrollments.find_one({'eid': 1002})['enrollmentHash']
+
+def test_failed_hash_write_is_reported():
+    from tx_pipeline import HashWriter
+    import asyncio
+
+    class BrokenEnrollments:
+        def bulk_write(self, ops, ordered=True):
+            raise OSError("connection reset")
+
+        def aggregate(self, pipeline, **options):
+            return []
+
+    writer = HashWriter(type('BrokenDb', (), {'enrollments': BrokenEnrollments()})(), batch_size=1)
+
+    async def run():
+        writer.add({'eid': 1, 'sid': 1}, '0x' + '00' * 32)
+        await writer.close()
+
+    with pytest.raises(RuntimeError, match='hash write batches failed'):
+        asyncio.run(run())
+
+def test_hashes_resolve_on_chain(db, stats):
+    from web3 import Web3
+    from tx_pipeline import DEPLOYMENT_PATH, GANACHE_RPC
+    import json
+    with open(DEPLOYMENT_PATH, 'r') as f:
+        info = json.load(f)
+    contract = Web3(Web3.HTTPProvider(GANACHE_RPC)).eth.contract(address=info['address'], abi=info['abi'])
+    enrollment = db.enrollments.find_one({'eid': 1})
+    sid, cid, grade, status = contract.functions.enrollments(enrollment['enrollmentHash']).call()
+    assert (sid, cid, grade, status) == (enrollment['sid'], enrollment['cid'], 'A', 'Completed')
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,357 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from eth_account import Account
+from pymongo import UpdateOne
+from web3 import AsyncWeb3, Web3
+from web3.exceptions import TransactionNotFound, Web3Exception
+
+from uchain import decrypt_grade
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEPLOYMENT_PATH = os.path.join(BASE_DIR, "deployment.json")
+GANACHE_RPC = os.getenv("GANACHE_RPC", "http://127.0.0.1:8545")
+
+ENROLLMENT_STORED_TOPIC = Web3.to_hex(Web3.keccak(text="EnrollmentStored(bytes32,uint256,uint256)"))
+
+MAX_IN_FLIGHT = 64
+GAS_LIMIT = 300000
+RECEIPT_TIMEOUT = 30
+DROP_CHECK_INTERVAL = 1.0
+POLL_INTERVAL = 0.1
+MAX_ATTEMPTS = 5
+# Nodes only accept a replacement for the same nonce if it pays >= 10% more.
+GAS_BUMP = 1.125
+WRITE_BATCH = 500
+# Errors worth retrying a send or poll for; anything else fails the enrollment.
+TRANSIENT_ERRORS = (ValueError, Web3Exception, OSError, asyncio.TimeoutError)
+
+
+class NonceManager:
+    # Nonces are handed out locally so a transaction never waits on the
+    # previous one being mined before it can be signed.
+    def __init__(self, next_nonce):
+        self._next = next_nonce
+
+    @classmethod
+    async def for_account(cls, w3, address):
+        return cls(await w3.eth.get_transaction_count(address, "pending"))
+
+    def take(self):
+        nonce = self._next
+        self._next += 1
+        return nonce
+
+
+def sync_student_hashes(db, sids=None, batch_size=WRITE_BATCH):
+    # Rebuild students.enrollments and currentHash from the enrollment hashes
+    # in eid order, so currentHash is always the student's latest enrollment
+    # no matter what order the receipts came back in. Safe to re-run.
+    sids = None if sids is None else sorted(sids)
+    chunks = [None] if sids is None else [sids[i:i + 10000] for i in range(0, len(sids), 10000)]
+    for chunk in chunks:
+        match = {"enrollmentHash": {"$ne": None}}
+        if chunk is not None:
+            match["sid"] = {"$in": chunk}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"eid": 1}},
+            {"$group": {"_id": "$sid", "hashes": {"$push": "$enrollmentHash"}}}
+        ]
+        ops = []
+        for r in db.enrollments.aggregate(pipeline, allowDiskUse=True):
+            ops.append(UpdateOne(
+                {"stid": r["_id"]},
+                {"$set": {"enrollments": r["hashes"], "currentHash": r["hashes"][-1]}}))
+            if len(ops) >= batch_size:
+                db.students.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            db.students.bulk_write(ops, ordered=False)
+
+
+class HashWriter:
+    # Buffers confirmed hashes and writes them onto the enrollments with
+    # bulk_write. Batches arrive in confirmation order, not eid order, so the
+    # students are only rebuilt (in eid order) once everything is written.
+    def __init__(self, db, batch_size=WRITE_BATCH):
+        self.db = db
+        self.batch_size = batch_size
+        self.sids = set()
+        self._buffer = []
+        self._flushes = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def add(self, enrollment, enrollment_hash):
+        self._buffer.append((enrollment, enrollment_hash))
+        self.sids.add(enrollment["sid"])
+        if len(self._buffer) >= self.batch_size:
+            self._schedule()
+
+    def _schedule(self):
+        batch, self._buffer = self._buffer, []
+        loop = asyncio.get_running_loop()
+        # Every flush is kept, finished or not, so close() sees each failure.
+        self._flushes.append((batch, loop.run_in_executor(self._executor, self._write, batch)))
+
+    def _write(self, batch):
+        self.db.enrollments.bulk_write([
+            UpdateOne({"eid": enrollment["eid"]}, {"$set": {"enrollmentHash": enrollment_hash}})
+            for enrollment, enrollment_hash in batch
+        ], ordered=False)
+
+    async def close(self):
+        if self._buffer:
+            self._schedule()
+        try:
+            results = await asyncio.gather(*(f for _, f in self._flushes), return_exceptions=True)
+            failed = [(batch, err) for (batch, _), err in zip(self._flushes, results) if isinstance(err, BaseException)]
+            # These transactions are already on chain; print the hashes so they
+            # can be written by hand instead of being stored a second time.
+            for batch, err in failed:
+                print(f"Failed to write {len(batch)} enrollment hashes: {err!r}")
+                for enrollment, enrollment_hash in batch:
+                    print(f"  eid {enrollment['eid']}: {enrollment_hash}")
+            if self.sids:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._executor, sync_student_hashes, self.db, self.sids)
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(self._flushes)} hash write batches failed")
+        finally:
+            self._executor.shutdown()
+
+
+class EnrollmentPipeline:
+    def __init__(self, w3, contract, account, chain_id, gas_price, nonces,
+                 max_in_flight=MAX_IN_FLIGHT, gas=GAS_LIMIT,
+                 receipt_timeout=RECEIPT_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.w3 = w3
+        self.contract = contract
+        self.account = account
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.nonces = nonces
+        self.max_in_flight = max_in_flight
+        self.gas = gas
+        self.receipt_timeout = receipt_timeout
+        self.max_attempts = max_attempts
+        self.stats = {"submitted": 0, "confirmed": 0, "failed": 0, "replaced": 0}
+
+    @classmethod
+    async def connect(cls, private_key, rpc_url=GANACHE_RPC, deployment_path=DEPLOYMENT_PATH, **options):
+        with open(deployment_path, "r") as f:
+            deployment = json.load(f)
+        w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc_url))
+        contract = w3.eth.contract(address=deployment["address"], abi=deployment["abi"])
+        account = Account.from_key(private_key)
+        chain_id = await w3.eth.chain_id
+        gas_price = await w3.eth.gas_price
+        nonces = await NonceManager.for_account(w3, account.address)
+        return cls(w3, contract, account, chain_id, gas_price, nonces, **options)
+
+    async def run(self, enrollments, writer=None):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        in_flight = set()
+
+        def done(task):
+            in_flight.discard(task)
+            slots.release()
+            # _submit handles its own failures; this only catches the unexpected.
+            if not task.cancelled() and task.exception() is not None:
+                self.stats["failed"] += 1
+                print(f"Submission crashed: {task.exception()!r}")
+
+        started = time.perf_counter()
+        try:
+            async for batch in _batches(enrollments, self.max_in_flight):
+                for enrollment in batch:
+                    await slots.acquire()
+                    # Take the nonce here, in input order, rather than inside the task.
+                    task = asyncio.create_task(self._submit(enrollment, self.nonces.take(), writer))
+                    in_flight.add(task)
+                    task.add_done_callback(done)
+        finally:
+            # Whatever happens, hashes already confirmed on chain get written
+            # back; otherwise a re-run would store them a second time.
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            if writer is not None:
+                await writer.close()
+
+        elapsed = time.perf_counter() - started
+        self.stats["elapsed"] = elapsed
+        self.stats["tps"] = self.stats["confirmed"] / elapsed if elapsed else 0.0
+        return self.stats
+
+    async def _submit(self, enrollment, nonce, writer):
+        # Every hash broadcast for this nonce (whichever one is mined wins) and
+        # the highest price offered, so a cancel can outbid all of them.
+        state = {"sent": [], "gas_price": self.gas_price}
+        self.stats["submitted"] += 1
+        try:
+            return await self._submit_nonce(enrollment, nonce, writer, state)
+        except Exception as err:
+            # Bad row (e.g. undecryptable grade) or a lost connection: never
+            # leave the nonce empty, or every later transaction queues behind it.
+            self.stats["failed"] += 1
+            print(f"Submission failed for eid {enrollment.get('eid')}: {err!r}")
+            if state["sent"]:
+                print(f"  already broadcast as {[Web3.to_hex(h) for h in state['sent']]}; check before re-running")
+            await self._cancel(nonce, state["gas_price"])
+
+    async def _submit_nonce(self, enrollment, nonce, writer, state):
+        grade = enrollment["grade"]
+        if "grade_key" in enrollment:
+            grade = decrypt_grade(grade, enrollment["grade_key"].encode())
+        tx = await self.contract.functions.storeEnrollment(
+            int(enrollment["sid"]), int(enrollment["cid"]), grade, enrollment["status"]
+        ).build_transaction({
+            "from": self.account.address,
+            "nonce": nonce,
+            "gas": self.gas,
+            "gasPrice": state["gas_price"],
+            "chainId": self.chain_id,
+        })
+
+        sent = state["sent"]
+        for attempt in range(self.max_attempts):
+            gas_price = state["gas_price"]
+            tx["gasPrice"] = gas_price
+            try:
+                sent.append(await self._send(tx))
+            except TRANSIENT_ERRORS as err:
+                message = str(err).lower()
+                if not sent or ("nonce too low" not in message and "already known" not in message):
+                    print(f"Send failed for eid {enrollment.get('eid')} (attempt {attempt + 1}): {err}")
+                    state["gas_price"] = int(gas_price * GAS_BUMP) + 1
+                    await asyncio.sleep(POLL_INTERVAL * (2 ** attempt))
+                    continue
+
+            receipt = await self._wait_for_receipt(sent)
+            if receipt is not None:
+                return self._confirm(enrollment, receipt, writer)
+            # Dropped or stuck: re-broadcast the same nonce at a higher price.
+            state["gas_price"] = int(gas_price * GAS_BUMP) + 1
+            self.stats["replaced"] += 1
+
+        self.stats["failed"] += 1
+        print(f"Giving up on eid {enrollment.get('eid')} after {self.max_attempts} attempts.")
+        await self._cancel(nonce, state["gas_price"])
+
+    async def _send(self, tx):
+        signed = self.account.sign_transaction(tx)
+        raw = getattr(signed, "raw_transaction", None) or signed.rawTransaction
+        return await self.w3.eth.send_raw_transaction(raw)
+
+    async def _wait_for_receipt(self, tx_hashes):
+        deadline = time.monotonic() + self.receipt_timeout
+        next_drop_check = time.monotonic() + DROP_CHECK_INTERVAL
+        while time.monotonic() < deadline:
+            for tx_hash in tx_hashes:
+                try:
+                    return await self.w3.eth.get_transaction_receipt(tx_hash)
+                except TransactionNotFound:
+                    pass
+                except TRANSIENT_ERRORS as err:
+                    # The node hiccupped, the transaction may still be mined.
+                    print(f"Receipt poll failed for {Web3.to_hex(tx_hash)}: {err}")
+            if time.monotonic() >= next_drop_check:
+                try:
+                    if await self._dropped(tx_hashes):
+                        return None
+                except TRANSIENT_ERRORS:
+                    pass
+                next_drop_check = time.monotonic() + DROP_CHECK_INTERVAL
+            await asyncio.sleep(POLL_INTERVAL)
+        return None
+
+    async def _dropped(self, tx_hashes):
+        for tx_hash in tx_hashes:
+            try:
+                await self.w3.eth.get_transaction(tx_hash)
+                return False
+            except TransactionNotFound:
+                pass
+        return True
+
+    async def _cancel(self, nonce, gas_price):
+        # Fill (or replace whatever is stuck at) the nonce with an empty
+        # self-transfer so later transactions are not held up behind it.
+        try:
+            await self._send({
+                "from": self.account.address,
+                "to": self.account.address,
+                "value": 0,
+                "nonce": nonce,
+                "gas": 21000,
+                "gasPrice": int(gas_price * GAS_BUMP) + 1,
+                "chainId": self.chain_id,
+            })
+        except TRANSIENT_ERRORS as err:
+            print(f"Failed to cancel nonce {nonce}: {err}")
+
+    def _confirm(self, enrollment, receipt, writer):
+        if receipt["status"] != 1:
+            self.stats["failed"] += 1
+            print(f"storeEnrollment reverted for eid {enrollment.get('eid')}")
+            return None
+        for log in receipt["logs"]:
+            topics = log["topics"]
+            if topics and Web3.to_hex(topics[0]) == ENROLLMENT_STORED_TOPIC:
+                enrollment_hash = Web3.to_hex(topics[1])
+                break
+        else:
+            self.stats["failed"] += 1
+            print(f"No EnrollmentStored event for eid {enrollment.get('eid')}")
+            return None
+        self.stats["confirmed"] += 1
+        if writer is not None:
+            writer.add(enrollment, enrollment_hash)
+        return enrollment_hash
+
+
+async def _batches(enrollments, size):
+    # pymongo cursors block on every getMore; pull them on a worker thread so
+    # receipt polling on the event loop keeps running meanwhile.
+    loop = asyncio.get_running_loop()
+    rows = iter(enrollments)
+    while True:
+        batch = await loop.run_in_executor(None, lambda: list(itertools.islice(rows, size)))
+        if not batch:
+            return
+        yield batch
+
+
+def pending_enrollments(db, limit=0):
+    return db.enrollments.find({"enrollmentHash": None}).sort("eid", 1).limit(limit)
+
+
+def submit_enrollments(db, enrollments, private_key=None, write_batch=WRITE_BATCH, **options):
+    private_key = private_key or os.getenv("GANACHE_PRIVATE_KEY")
+    if not private_key:
+        raise ValueError("GANACHE_PRIVATE_KEY environment variable is required. Please set it in your .env file.")
+
+    async def run():
+        pipeline = await EnrollmentPipeline.connect(private_key, **options)
+        return await pipeline.run(enrollments, HashWriter(db, write_batch))
+
+    stats = asyncio.run(run())
+    print(f"Confirmed {stats['confirmed']:,} of {stats['submitted']:,} transactions "
+          f"in {stats['elapsed']:.2f}s ({stats['tps']:.1f} tx/s), "
+          f"{stats['replaced']} replaced, {stats['failed']} failed")
+    return stats
+
+
+if __name__ == "__main__":
+    from uchain import connect_to_mongo, create_database_and_collections
+
+    client = connect_to_mongo()
+    db = create_database_and_collections(client)
+    submit_enrollments(db, pending_enrollments(db))
+    client.close()
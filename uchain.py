@@ -1,8 +1,17 @@
-import json
-from pymongo import MongoClient, errors
-from cryptography.fernet import Fernet
+import time
+_STARTED = time.perf_counter()
+
+import argparse
 import base64
+import importlib
+import json
 import os
+import sys
+from contextlib import contextmanager
+
+# pymongo, cryptography, web3, the reports (multiprocessing) and the cluster
+# harness are imported inside the functions that need them so
+# `python uchain.py get 42` doesn't pay for all of them up front.
 
 CONNECTION_STRING = ""
 DB_NAME = "university_db"
@@ -16,39 +25,74 @@ DATA_MAP = {
     "Classes.json": "classes",
     "Enrollments.json": "enrollments"
 }
+COUNTERS_COLLECTION = "counters"
+EID_BLOCK_SIZE = 1000
+DEFAULT_PARALLELISM = os.cpu_count() or 4
+BENCH_TX_DB = f"{DB_NAME}_bench_tx"
+
+def mongo_uri():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("MONGO_URI", CONNECTION_STRING)
 
-def connect_to_mongo():
+def connect_to_mongo(uri=None, ping=True):
+    from pymongo import MongoClient, errors
+    uri = uri or mongo_uri()
+    if not uri:
+        raise ValueError("MONGO_URI environment variable is required. Please set it in your .env file.")
     try:
-        client = MongoClient(CONNECTION_STRING)
-        client.admin.command('ping')
-        print("Connected successfully!")
+        client = MongoClient(uri)
+        if ping:
+            client.admin.command('ping')
+            print("Connected successfully!")
         return client
-    except errors.ServerSelectionTimeoutError as err:
+    except (errors.ConfigurationError, errors.ServerSelectionTimeoutError) as err:
         print("Connection failed.")
         raise err
 
-def create_database_and_collections(client):
-    db = client[DB_NAME]
+def create_database_and_collections(client, db_name=DB_NAME):
+    db = client[db_name]
     for collection_name in DATA_MAP.values():
         if collection_name not in db.list_collection_names():
             db.create_collection(collection_name)
+    # A second enrollment with the same eid fails loudly instead of shadowing
+    # the first one.
+    db.enrollments.create_index("eid", unique=True)
+    # Fields the reports split their aggregations on (see reports.py).
+    db.students.create_index("stid")
+    db.enrollments.create_index("sid")
     return db
 
 def clear_database(db):
     for collection_name in DATA_MAP.values():
         db[collection_name].delete_many({})
+    # Enrollments are gone, so eids can start over from the counter.
+    db[COUNTERS_COLLECTION].delete_one({"_id": "eid"})
     print("All collections cleared.")
 
-def load_and_insert_data(db):
+def load_and_insert_data(db, data_dir="."):
     clear_database(db)
     for file_name, collection_name in DATA_MAP.items():
         try:
-            with open(file_name, 'r') as f:
+            with open(os.path.join(data_dir, file_name), 'r') as f:
                 data = json.load(f)
             if data:
                 if collection_name == "enrollments":
+                    # File eids are kept, students.enrollments refers to them.
+                    # Push the counter past them before inserting, then hand
+                    # out fresh ids to any rows that came without one.
+                    eids, duplicates = set(), set()
+                    for e in data:
+                        if "eid" in e:
+                            (duplicates if e["eid"] in eids else eids).add(e["eid"])
+                    if duplicates:
+                        raise ValueError(f"Duplicate eids in {file_name}: {sorted(duplicates)[:10]}")
+                    seed_eid_counter(db, max(eids, default=0))
+                    allocator = EidAllocator(db)
                     processed = []
                     for e in data:
+                        if "eid" not in e:
+                            e["eid"] = allocator.next()
                         processed.append(toBlock(e))
                     db[collection_name].insert_many(processed)
                 else:
@@ -59,29 +103,59 @@ def load_and_insert_data(db):
         except json.JSONDecodeError:
             print(f"Invalid JSON in {file_name}. Skipping.")
 
+# -------------------------------------------------------------------------
+# eids come from a single counter document so the API and the loaders never
+# hand out the same id. One $inc reserves a whole block.
+def seed_eid_counter(db, min_seq=None):
+    if min_seq is None:
+        last = db.enrollments.find_one(sort=[("eid", -1)], projection={"eid": 1})
+        min_seq = last["eid"] if last else 0
+    db[COUNTERS_COLLECTION].update_one(
+        {"_id": "eid"}, {"$max": {"seq": min_seq}}, upsert=True)
+
+def reserve_eids(db, count=1):
+    from pymongo import ReturnDocument
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    counters = db[COUNTERS_COLLECTION]
+    counter = counters.find_one_and_update(
+        {"_id": "eid"},
+        {"$inc": {"seq": count}},
+        return_document=ReturnDocument.AFTER)
+    if counter is None:
+        # No counter yet on a database that may already hold enrollments:
+        # start past the highest eid, the same way nextEid() in the API does.
+        seed_eid_counter(db)
+        counter = counters.find_one_and_update(
+            {"_id": "eid"},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+    end = counter["seq"]
+    return range(end - count + 1, end + 1)
+
+class EidAllocator:
+    def __init__(self, db, block_size=EID_BLOCK_SIZE):
+        self.db = db
+        self.block_size = block_size
+        self._block = iter(())
+
+    def next(self):
+        eid = next(self._block, None)
+        if eid is None:
+            self._block = iter(reserve_eids(self.db, self.block_size))
+            eid = next(self._block)
+        return eid
+
+def next_eid(db):
+    return reserve_eids(db, 1)[0]
+# -------------------------------------------------------------------------
+
 # We can't do this for free.
+# Needs a mongos; see sharding.py for the plan and a local test cluster.
 def setup_sharding(db):
-    try:
-        db.admin.command({'enableSharding': DB_NAME})
-        print("Sharding enabled on database.")
-    except errors.OperationFailure:
-        print("Failed to enable sharding.")
-    shard_configs = {
-        "universities": {"uid": 1},
-        "schools": {"sid": 1},
-        "departments": {"did": 1},
-        "advisors": {"aid": 1},
-        "students": {"stid": 1},
-        "professors": {"pid": 1},
-        "classes": {"cid": 1},
-        "enrollments": {"eid": 1}
-    }
-    for collection, key in shard_configs.items():
-        try:
-            db.admin.command({'shardCollection': f"{DB_NAME}.{collection}", 'key': key})
-            print(f"Sharded {collection} with key {key}")
-        except errors.OperationFailure:
-            print(f"Failed to shard {collection}.")
+    from sharding import apply_shard_plan
+    apply_shard_plan(db.client, db.name)
 
 def setup_vertical_fragmentation(db):
     students_coll = db["students"]
@@ -99,9 +173,11 @@ def generate_key_for_enrollment(eid):
     return base64.urlsafe_b64encode(raw.ljust(32, b'_')[:32])
 
 def encrypt_grade(grade, key):
+    from cryptography.fernet import Fernet
     return Fernet(key).encrypt(grade.encode()).decode()
 
 def decrypt_grade(token, key):
+    from cryptography.fernet import Fernet
     return Fernet(key).decrypt(token.encode()).decode()
 
 # Integrate with the blockchain.
@@ -126,102 +202,39 @@ def getBlock(db, eid):
     return e
 # -------------------------------------------------------------------------
 
-def query_grade_distribution(db):
+def query_grade_distribution(db, parallelism=DEFAULT_PARALLELISM):
     print("="*70)
     print("Grade Dist.")
     print("="*70)
-    pipeline = [
-        {"$project": {"eid": 1, "grade": 1, "grade_key": 1}}
-    ]
-    counts = {}
-    for e in db.enrollments.aggregate(pipeline):
-        try:
-            grade = decrypt_grade(e["grade"], e["grade_key"].encode())
-            counts[grade] = counts.get(grade, 0) + 1
-        except:
-            pass
+    from reports import grade_distribution
+    counts = grade_distribution(db, decrypt_grade, parallelism)
     for g, c in counts.items():
         print(f"{g}: {c}")
 
-def query_1_students_per_university():
+def query_1_students_per_university(db, parallelism=DEFAULT_PARALLELISM):
     print("="*70)
     print("1. Students per University.")
     print("="*70)
+    from reports import students_per_university
 
-    pipeline = [
-        {"$lookup": {
-            "from": "departments",
-            "localField": "did",
-            "foreignField": "did",
-            "as": "department"
-        }},
-        {"$unwind": "$department"},
-        {"$lookup": {
-            "from": "schools",
-            "localField": "did",
-            "foreignField": "departments",
-            "as": "school"
-        }},
-        {"$unwind": "$school"},
-        {"$lookup": {
-            "from": "universities",
-            "localField": "school.sid",
-            "foreignField": "schools",
-            "as": "university"
-        }},
-        {"$unwind": "$university"},
-        {"$group": {
-            "_id": "$university.name",
-            "student_count": {"$sum": 1}
-        }},
-        {"$sort": {"student_count": -1}}
-    ]
-
-    results = list(db.students.aggregate(pipeline))
-    for r in results:
-        print(f"{r['_id']}: {r['student_count']:,} students")
+    for name, count in students_per_university(db, parallelism):
+        print(f"{name}: {count:,} students")
     print()
 
-def query_2_students_sharing_professors():
+def query_2_students_sharing_professors(db, parallelism=DEFAULT_PARALLELISM):
     print("="*70)
     print("2. Students who share 1...2...3...Profs.")
     print("="*70)
-    
-    pipeline = [
-        {"$lookup": {
-            "from": "classes",
-            "localField": "cid",
-            "foreignField": "cid",
-            "as": "class"
-        }},
-        {"$unwind": "$class"},
-        
-        {"$group": {
-            "_id": "$sid",
-            "professors": {"$addToSet": "$class.pid"}
-        }},
-        
-        {"$bucket": {
-            "groupBy": {"$size": "$professors"},
-            "boundaries": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 20, 50],
-            "default": "50+",
-            "output": {
-                "students": {"$sum": 1}
-            }
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    
-    results = list(db.enrollments.aggregate(pipeline, maxTimeMS=6000000))
-    for r in results:
-        bucket = r["_id"]
+    from reports import students_sharing_professors
+
+    for bucket, students in students_sharing_professors(db, parallelism):
         if bucket == "50+":
-            print(f"50 or more professors: {r['students']:,} students")
+            print(f"50 or more professors: {students:,} students")
         else:
-            print(f"{bucket} unique professor(s): {r['students']:,} students")
+            print(f"{bucket} unique professor(s): {students:,} students")
     print()
 
-def query_3_rida_classes():
+def query_3_rida_classes(db):
     print("="*70)
     print("3. All Rida Classes.")
     print("="*70)
@@ -246,19 +259,193 @@ def query_3_rida_classes():
     print()
 
 
-if __name__ == "__main__":
-    client = connect_to_mongo()
-    db = create_database_and_collections(client)
+# -------------------------------------------------------------------------
+class StageTimer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = [("startup", time.perf_counter() - _STARTED)]
 
-    #load_and_insert_data(db)
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - started))
 
-    # We cannot do this for free.
-    #setup_sharding(db)
-    #setup_vertical_fragmentation(db)
+    def report(self):
+        if not self.enabled:
+            return
+        print("="*70)
+        print("Timing")
+        print("="*70)
+        for name, seconds in self.stages:
+            print(f"{name:<28}{seconds * 1000:>10.1f} ms")
+        print(f"{'total':<28}{(time.perf_counter() - _STARTED) * 1000:>10.1f} ms")
 
-    query_1_students_per_university()
-    #query_2_students_sharing_professors()
-    query_3_rida_classes()
-    query_grade_distribution(db)
+REPORTS = {
+    "students-per-university": query_1_students_per_university,
+    "shared-professors": query_2_students_sharing_professors,
+    "rida": lambda db, parallelism: query_3_rida_classes(db),
+    "grades": query_grade_distribution,
+}
+BENCH_REPORTS = {
+    "students-per-university": lambda reports, db, p: reports.students_per_university(db, p),
+    "shared-professors": lambda reports, db, p: reports.students_sharing_professors(db, p),
+    "grades": lambda reports, db, p: reports.grade_distribution(db, decrypt_grade, p),
+}
+# Heavy modules each subcommand needs, imported in their own timed stage.
+COMMAND_MODULES = {
+    "load": ["pymongo", "cryptography.fernet"],
+    "shard": ["pymongo", "sharding"],
+    "fragment": ["pymongo"],
+    "report": ["pymongo", "cryptography.fernet", "reports"],
+    "get": ["pymongo", "cryptography.fernet"],
+    "bench": ["pymongo", "cryptography.fernet"],
+}
+BENCH_MODULES = {"reports": ["reports"], "shards": ["sharding"], "tx": ["tx_pipeline"]}
+
+def cmd_load(args, db, timer):
+    with timer.stage("load"):
+        db = create_database_and_collections(db.client, db.name)
+        load_and_insert_data(db, args.data_dir)
+
+def cmd_shard(args, db, timer):
+    with timer.stage("shard"):
+        setup_sharding(db)
+
+def cmd_fragment(args, db, timer):
+    with timer.stage("fragment"):
+        setup_vertical_fragmentation(db)
+
+def cmd_report(args, db, timer):
+    names = list(REPORTS) if args.name == "all" else [args.name]
+    for name in names:
+        with timer.stage(f"report {name}"):
+            REPORTS[name](db, args.parallelism)
+
+def cmd_get(args, db, timer):
+    with timer.stage("get"):
+        e = getBlock(db, args.eid)
+    if e is None:
+        print(f"Enrollment {args.eid} not found.")
+        return 1
+    print(json.dumps(e, indent=2, default=str))
+
+def cmd_bench(args, db, timer):
+    if args.target == "reports":
+        import reports
+        print(f"{'report':<28}" + "".join(f"{f'p={p}':>10}" for p in args.parallelism))
+        for name, run in BENCH_REPORTS.items():
+            row = []
+            for p in args.parallelism:
+                with timer.stage(f"bench {name} p={p}"):
+                    started = time.perf_counter()
+                    run(reports, db, p)
+                    row.append(time.perf_counter() - started)
+            print(f"{name:<28}" + "".join(f"{t:>9.2f}s" for t in row))
+    elif args.target == "shards":
+        from sharding import LocalCluster, measure_cluster
+        for shards in args.shards:
+            with timer.stage(f"bench {shards} shard(s)"):
+                with LocalCluster(shards=shards) as cluster:
+                    client = cluster.client()
+                    t = measure_cluster(client, DB_NAME)
+                    client.close()
+            print(f"{shards} shard(s): {t['enrollments_per_sec']:,.0f} inserts/s, "
+                  f"{t['reads_per_sec']:,.0f} transcript reads/s, rollup {t['did_rollup']:.3f}s")
+    elif args.target == "tx":
+        # Synthetic enrollments in a throwaway database: the transactions are
+        # real, but the enrollments being backfilled are never touched.
+        from tx_pipeline import pending_enrollments, submit_enrollments
+        if args.scratch_db == db.name:
+            print(f"Refusing to benchmark in {db.name}; pick another --scratch-db.")
+            return 2
+        db.client.drop_database(args.scratch_db)
+        scratch = db.client[args.scratch_db]
+        try:
+            scratch.students.insert_many([{"stid": sid, "enrollments": [], "currentHash": ""} for sid in range(1, 101)])
+            scratch.enrollments.insert_many([
+                {"eid": eid, "sid": eid % 100 + 1, "cid": eid % 40 + 1, "grade": "ABCDF"[eid % 5], "status": "Completed"}
+                for eid in range(1, args.count + 1)
+            ])
+            with timer.stage(f"bench tx x{args.count}"):
+                submit_enrollments(scratch, pending_enrollments(scratch), max_in_flight=args.in_flight)
+        finally:
+            db.client.drop_database(args.scratch_db)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="uchain", description="UChain database tools.")
+    parser.add_argument("--uri", help="MongoDB connection string (default: MONGO_URI from the environment or .env)")
+    parser.add_argument("--db", default=DB_NAME, help=f"database name (default: {DB_NAME})")
+    parser.add_argument("--ping", action="store_true", help="ping the server before running")
+    parser.add_argument("--timing", action="store_true", help="print import, connect and per-stage durations (implies --ping)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="clear the database and load the JSON data files")
+    load.add_argument("--data-dir", default=".", help="directory holding the JSON files")
+    load.set_defaults(func=cmd_load)
+
+    sub.add_parser("shard", help="apply the sharding plan (needs a mongos)").set_defaults(func=cmd_shard)
+    sub.add_parser("fragment", help="move student enrollments into students_enrollments").set_defaults(func=cmd_fragment)
 
-    client.close()
+    report = sub.add_parser("report", help="run a report")
+    report.add_argument("name", choices=list(REPORTS) + ["all"])
+    report.add_argument("-p", "--parallelism", type=int, default=DEFAULT_PARALLELISM)
+    report.set_defaults(func=cmd_report)
+
+    get = sub.add_parser("get", help="print one enrollment with its grade decrypted")
+    get.add_argument("eid", type=int)
+    get.set_defaults(func=cmd_get)
+
+    bench = sub.add_parser("bench", help="run a benchmark")
+    bench_sub = bench.add_subparsers(dest="target", required=True)
+    bench_reports = bench_sub.add_parser("reports", help="time each report at several degrees of parallelism")
+    bench_reports.add_argument("-p", "--parallelism", type=int, nargs="+", default=[1, 2, 4, 8])
+    bench_shards = bench_sub.add_parser("shards", help="insert/query scaling on a local mongod/mongos cluster")
+    bench_shards.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    bench_tx = bench_sub.add_parser("tx", help="submit synthetic enrollments to the chain and report tx/s")
+    bench_tx.add_argument("--count", type=int, default=200, help="synthetic enrollments to submit")
+    bench_tx.add_argument("--in-flight", type=int, default=64)
+    bench_tx.add_argument("--scratch-db", default=BENCH_TX_DB, help=f"throwaway database, dropped afterwards (default: {BENCH_TX_DB})")
+    bench.set_defaults(func=cmd_bench)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    timer = StageTimer(args.timing)
+
+    # bench shards starts its own cluster; everything else needs a server.
+    needs_mongo = not (args.command == "bench" and args.target == "shards")
+    uri = args.uri or (mongo_uri() if needs_mongo else None)
+    if needs_mongo and not uri:
+        print("MONGO_URI environment variable is required. Please set it in your .env file or pass --uri.")
+        return 2
+
+    modules = COMMAND_MODULES[args.command] + BENCH_MODULES.get(getattr(args, "target", None), [])
+    with timer.stage("import " + ", ".join(modules)):
+        for module in modules:
+            importlib.import_module(module)
+
+    client = None
+    try:
+        if needs_mongo:
+            from pymongo import errors
+            # MongoClient() connects lazily, so without a ping the handshake
+            # would be billed to the first stage instead of to connect.
+            try:
+                with timer.stage("connect + ping"):
+                    client = connect_to_mongo(uri, ping=args.ping or args.timing)
+            except errors.PyMongoError as err:
+                print(f"Connection failed: {err}")
+                return 2
+        db = client[args.db] if client else None
+        return args.func(args, db, timer)
+    finally:
+        if client:
+            client.close()
+        timer.report()
+
+
+if __name__ == "__main__":
+    sys.exit(main())